@@ -19,6 +19,10 @@ const attackButton = document.getElementById('attack-button');
 let ws; // WebSocket connection
 let selfId = null; // This client's player ID
 let gameState = { players: [], orbs: [], projectiles: [] };
+let playersByNetId = new Map(); // Authoritative client copies, gameState lists are rebuilt from these
+let orbsByNetId = new Map();
+let orbRadius = 5; // Default, will be updated by server
+let projectileRadius = 5;
 let mapWidth = 2000; // Default, will be updated by server
 let mapHeight = 2000;
 let selectedRace = null;
@@ -170,6 +174,7 @@ function connectWebSocket(name, race) {
 
     console.log(`Connecting to ${wsUrl}`);
     ws = new WebSocket(wsUrl);
+    ws.binaryType = 'arraybuffer'; // Per-tick state arrives as binary deltas
 
     ws.onopen = () => {
         console.log('Connected to WebSocket server.');
@@ -182,14 +187,20 @@ function connectWebSocket(name, race) {
 
     ws.onmessage = (event) => {
         try {
+            if (event.data instanceof ArrayBuffer) {
+                applyStateDelta(event.data);
+                return;
+            }
             const message = JSON.parse(event.data);
             switch (message.type) {
                 case 'welcome':
                     selfId = message.playerId;
                     mapWidth = message.mapWidth;
                     mapHeight = message.mapHeight;
+                    orbRadius = message.orbRadius;
+                    projectileRadius = message.projectileRadius;
                      // Initialize game state from welcome message
-                    gameState = message.initialState || { players: [], orbs: [], projectiles: [] };
+                    resetWorld(message.initialState || { players: [], orbs: [], projectiles: [] });
                     console.log(`Joined game with ID: ${selfId}. Initial state received.`);
                     // Find self player to potentially center camera immediately
                      const selfPlayerInitial = gameState.players.find(p => p.id === selfId);
@@ -200,10 +211,15 @@ function connectWebSocket(name, race) {
                     requestAnimationFrame(gameLoop); // Start rendering loop
                     detectTouchDevice(); // Detect touch after canvas is shown
                     break;
-                case 'gameState':
-                    // Update game state received from server
-                    // Simple replacement for now. Interpolation/prediction would modify this.
-                    gameState = message;
+                case 'playerJoined':
+                case 'playerInfo':
+                    // Full player data (on join, or when class/color changes)
+                    playersByNetId.set(message.player.netId, message.player);
+                    gameState.players = Array.from(playersByNetId.values());
+                    break;
+                case 'playerLeft':
+                    playersByNetId.delete(message.netId);
+                    gameState.players = Array.from(playersByNetId.values());
                     break;
                  case 'levelUpReady':
                      console.log("Level up ready! Showing selection.");
@@ -211,12 +227,10 @@ function connectWebSocket(name, race) {
                      break;
                  case 'classSelected':
                      console.log("Class/Mutation confirmed by server.");
-                      // Server sends updated player data with gameState anyway,
-                      // so we just need to hide the selection screen.
                      level2SelectionScreen.style.display = 'none'; // Hide selection
-                     // Ensure the levelUpReady flag is cleared on the client player object if needed
-                     const playerAfterSelect = gameState.players.find(p => p.id === selfId);
-                     if(playerAfterSelect) playerAfterSelect.canChooseLevel2 = false;
+                     // Take the updated player data (class, color, flags) right away
+                     playersByNetId.set(message.player.netId, message.player);
+                     gameState.players = Array.from(playersByNetId.values());
 
                      break;
                  case 'meleeVisual':
@@ -260,10 +274,96 @@ function connectWebSocket(name, race) {
          touchControls.style.display = 'none';
          level2SelectionScreen.style.display = 'none';
          selfId = null; // Clear selfId
-         gameState = { players: [], orbs: [], projectiles: [] }; // Clear game state
+         resetWorld({ players: [], orbs: [], projectiles: [] }); // Clear game state
+    };
+}
+
+// --- State Sync ---
+// Matches the server's binary delta layout (see encodeStateDelta in server.js)
+const MSG_STATE_DELTA = 1;
+const PLAYER_FLAG_DEAD = 1;
+const PLAYER_FLAG_CHOOSING = 2;
+
+function resetWorld(snapshot) {
+    playersByNetId = new Map(snapshot.players.map(p => [p.netId, p]));
+    orbsByNetId = new Map(snapshot.orbs.map(o => [o.netId, o]));
+    gameState = {
+        players: Array.from(playersByNetId.values()),
+        orbs: Array.from(orbsByNetId.values()),
+        projectiles: snapshot.projectiles
     };
 }
 
+function applyStateDelta(buffer) {
+    const view = new DataView(buffer);
+    if (view.getUint8(0) !== MSG_STATE_DELTA) return;
+    let o = 1;
+
+    // Changed players
+    let count = view.getUint16(o, true); o += 2;
+    for (let i = 0; i < count; i++) {
+        const player = playersByNetId.get(view.getUint32(o, true));
+        if (player) {
+            player.x = view.getFloat32(o + 4, true);
+            player.y = view.getFloat32(o + 8, true);
+            player.hp = view.getFloat32(o + 12, true);
+            player.maxHp = view.getFloat32(o + 16, true);
+            player.xp = view.getFloat32(o + 20, true);
+            player.killCount = view.getUint32(o + 24, true);
+            player.level = view.getUint8(o + 28);
+            const flags = view.getUint8(o + 29);
+            player.isDead = (flags & PLAYER_FLAG_DEAD) !== 0;
+            player.canChooseLevel2 = (flags & PLAYER_FLAG_CHOOSING) !== 0;
+        }
+        o += 30;
+    }
+
+    // Spawned orbs, then orbs that moved
+    for (let section = 0; section < 2; section++) {
+        count = view.getUint16(o, true); o += 2;
+        for (let i = 0; i < count; i++) {
+            const netId = view.getUint32(o, true);
+            const x = view.getFloat32(o + 4, true);
+            const y = view.getFloat32(o + 8, true);
+            const orb = orbsByNetId.get(netId);
+            if (orb) {
+                orb.x = x;
+                orb.y = y;
+            } else {
+                orbsByNetId.set(netId, { netId: netId, x: x, y: y, radius: orbRadius });
+            }
+            o += 12;
+        }
+    }
+
+    // Collected orbs
+    count = view.getUint16(o, true); o += 2;
+    for (let i = 0; i < count; i++) {
+        orbsByNetId.delete(view.getUint32(o, true));
+        o += 4;
+    }
+
+    // All live projectiles
+    count = view.getUint16(o, true); o += 2;
+    const projectiles = new Array(count);
+    for (let i = 0; i < count; i++) {
+        projectiles[i] = {
+            netId: view.getUint32(o, true),
+            x: view.getFloat32(o + 4, true),
+            y: view.getFloat32(o + 8, true),
+            dx: view.getFloat32(o + 12, true),
+            dy: view.getFloat32(o + 16, true),
+            color: '#' + view.getUint32(o + 20, true).toString(16).padStart(6, '0'),
+            radius: projectileRadius
+        };
+        o += 24;
+    }
+
+    gameState.players = Array.from(playersByNetId.values());
+    gameState.orbs = Array.from(orbsByNetId.values());
+    gameState.projectiles = projectiles;
+}
+
 // --- Input Handling ---
 function setupInputListeners() {
     // Keyboard
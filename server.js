@@ -4,6 +4,7 @@ const http = require('http');
 const WebSocket = require('ws');
 const path = require('path');
 const { v4: uuidv4 } = require('uuid');
+const { moveAndClamp, collectInCircle } = require('./tick');
 
 const app = express();
 const server = http.createServer(app);
@@ -25,39 +26,216 @@ const PROJECTILE_DAMAGE = 10;
 const ATTACK_COOLDOWN = 500; // milliseconds
 const MELEE_RANGE = PLAYER_RADIUS * 2.5;
 const LIFESTEAL_PERCENT = 0.1; // 10% for Lord Vampires
+const ORB_ATTRACT_RANGE = 50; // Extra distance beyond touching at which orbs drift toward players
+const QUADTREE_CAPACITY = 8; // Players per node before it splits
+const QUADTREE_MAX_DEPTH = 8;
+const QUADTREE_MIN_PLAYERS = 32; // Below this a straight scan of the movement columns beats the quadtree
+const QUADTREE_SLACK = 20; // Players may drift this far before the quadtree is rebuilt; queries are padded by it
+const ORB_GRID_CELL = 100; // Must be >= PLAYER_RADIUS + ORB_RADIUS + ORB_ATTRACT_RANGE so a 3x3 lookup covers every reachable orb
+
+// --- Logging ---
+// Per-event logs (connects, joins, kills, level ups) are off unless LOG_LEVEL=debug;
+// synchronous console writes to a piped stdout would otherwise stall the game loop under churn
+const DEBUG_LOGGING = process.env.LOG_LEVEL === 'debug';
+
+// --- Network Protocol ---
+// Per-tick state goes out as one binary frame holding only what changed since the last tick.
+// Everything else (welcome snapshot, joins, leaves, class changes) stays JSON.
+const MSG_STATE_DELTA = 1; // First byte of a binary state delta frame
+const PLAYER_FLAG_DEAD = 1;
+const PLAYER_FLAG_CHOOSING = 2;
+const PLAYER_DELTA_BYTES = 30; // u32 netId, f32 x, f32 y, f32 hp, f32 maxHp, f32 xp, u32 killCount, u8 level, u8 flags
+const ORB_DELTA_BYTES = 12; // u32 id, f32 x, f32 y
+const ORB_REMOVE_BYTES = 4; // u32 id
+const PROJECTILE_DELTA_BYTES = 24; // u32 id, f32 x, f32 y, f32 dx, f32 dy, u32 rgb
+const POSITION_EPSILON = 0.25; // Player moves smaller than this (vs. the last sent position) don't make a delta
+const KEEPALIVE_TICKS = 15; // With nothing changing, still send an (empty) delta this often
+const EMPTY_DELTA = Buffer.from([MSG_STATE_DELTA, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]); // Tag plus five zero u16 counts, the keep-alive frame
+const BROADCAST_BATCH_SIZE = 50; // Sends per event-loop turn before yielding to other I/O
+const TICK_YIELD_MASK = 31; // Game loop phases yield to the event loop every 32 entities
 
 // --- Game State ---
-let players = new Map(); // Map<playerId, playerData>
-let orbs = new Map(); // Map<orbId, orbData>
-let projectiles = new Map(); // Map<projectileId, projectileData>
+let players = new Map(); // Map<playerId, Player>
+let orbs = new Map(); // Map<orbId, orbData>, orb ids come from nextNetId
+let orbGrid = new Map(); // Map<cellKey, Set<orbSlot>> - uniform grid so players only test nearby orbs
+let projectiles = new Map(); // Map<projectileId, projectileData>, projectile ids come from nextNetId
+
+// Player movement state lives in parallel typed arrays (one row per player) so the
+// integration step is a tight loop over numbers instead of a walk over player objects.
+// Rows are kept dense: removing a player moves the last row into its slot.
+let playerCapacity = 64; // Grows by doubling when full
+let playerPosX = new Float64Array(playerCapacity);
+let playerPosY = new Float64Array(playerCapacity);
+let playerDirX = new Float64Array(playerCapacity); // Unit movement direction, zero when standing still
+let playerDirY = new Float64Array(playerCapacity);
+let playerSpeed = new Float64Array(playerCapacity);
+let playerRadius = new Float64Array(playerCapacity);
+let playerAtRow = []; // Array<Player> indexed by row
+let playerRowCount = 0;
+
+let nextNetId = 1; // Monotonic counter for player net ids and orb/projectile ids; compact in binary frames, never reused
+const orbsAdded = []; // Orb ids spawned since the last delta
+const orbsMoved = new Set(); // Orb ids pulled toward a player since the last delta
+const orbsRemoved = []; // Orb ids collected since the last delta
+
+// Per-tick scratch containers, cleared and reused instead of reallocated every tick
+const projectilesToRemove = [];
+const nearbyOrbs = []; // Orb slots from the grid cells around the current player
+const nearbyPlayers = []; // Result of queryPlayersNear(), valid until the next query
+const dirtyPlayers = [];
+const addedOrbs = [];
+const movedOrbs = [];
+const pendingHits = new Map(); // Map<Player, damage taken this tick>, flushed once per tick by flushHits()
+
+const shadedColorCache = new Map(); // Map<"color|amt", color>, see shadedColor()
+const colorRgbCache = new Map(); // Map<color, packed rgb>
+
+let ticksSinceDelta = 0; // Ticks since a state delta was last broadcast
+let lastSentProjectileCount = 0; // Projectiles in the last delta, so their removal still gets a frame
+let clientList = null; // Cached Array.from(wss.clients), see getClientList()
+
+let broadcastQueue = []; // Pending { data, clients, except, next } jobs, drained in order
+let broadcastDraining = false;
+
+// Orb positions live in fixed-size typed arrays, one slot per possible orb (at most ORB_COUNT
+// exist at once), so the pickup pass reads contiguous numbers. Each slot owns one Orb object
+// that is reused across spawns; collecting an orb just hands its slot back.
+const orbPosX = new Float64Array(ORB_COUNT);
+const orbPosY = new Float64Array(ORB_COUNT);
+const orbAtSlot = []; // Array<Orb> indexed by slot, filled on first use
+const freeOrbSlots = []; // Slots not holding a live orb
+for (let slot = ORB_COUNT - 1; slot >= 0; slot--) freeOrbSlots.push(slot);
+
+let playerTree = null; // Quadtree over player positions, see refreshPlayerTree(); null while unused
+let playerTreeMembershipChanged = true; // Set when a player joins or leaves
+let playerTreeX = new Float64Array(playerCapacity); // Per-row position at the time the tree was built
+let playerTreeY = new Float64Array(playerCapacity);
 
 // --- Player Data Structure ---
-function createPlayer(id, ws, name, race) {
-    const raceData = getRaceBaseStats(race);
-    return {
-        id: id,
-        ws: ws, // Keep a reference to the WebSocket connection
-        name: name,
-        x: Math.random() * (MAP_WIDTH - 100) + 50,
-        y: Math.random() * (MAP_HEIGHT - 100) + 50,
-        vx: 0, // Velocity x
-        vy: 0, // Velocity y
-        hp: raceData.hp,
-        maxHp: raceData.hp,
-        level: 1,
-        xp: 0,
-        race: race,
-        classOrMutation: null, // 'warrior', 'mage', 'lord', 'higher', 'king', 'hobgoblin'
-        color: raceData.color,
-        radius: PLAYER_RADIUS,
-        speed: raceData.speed,
-        attackCooldown: 0, // Time until next attack is allowed
-        lastInput: null, // { up, down, left, right, attack, mouseX, mouseY }
-        isDead: false,
-        killCount: 0,
-        canChooseLevel2: false, // Flag to show selection screen
-        stats: { ...raceData.stats } // Specific stats like damage, range, lifesteal etc.
-    };
+// A class rather than an object literal: every player gets the same fields in the same order
+// (one stable hidden class), and the column accessors live once on the prototype instead of
+// being new closures per player.
+class Player {
+    constructor(id, ws, name, race) {
+        const raceData = getRaceBaseStats(race);
+        const row = allocatePlayerRow();
+        playerPosX[row] = Math.random() * (MAP_WIDTH - 100) + 50;
+        playerPosY[row] = Math.random() * (MAP_HEIGHT - 100) + 50;
+        playerDirX[row] = 0;
+        playerDirY[row] = 0;
+        playerRadius[row] = PLAYER_RADIUS;
+
+        this.id = id;
+        this.netId = nextNetId++;
+        this.ws = ws; // Keep a reference to the WebSocket connection
+        this.name = name;
+        this.row = row; // Index into the movement columns
+        this.hp = raceData.hp;
+        this.maxHp = raceData.hp;
+        this.level = 1;
+        this.xp = 0;
+        this.race = race;
+        this.classOrMutation = null; // 'warrior', 'mage', 'lord', 'higher', 'king', 'hobgoblin'
+        this.color = raceData.color;
+        this.speed = raceData.speed;
+        this.attackCooldown = 0; // Time until next attack is allowed
+        this.lastInput = null; // { up, down, left, right, attack, mouseX, mouseY }, reused once set
+        this.isDead = false;
+        this.killCount = 0;
+        this.canChooseLevel2 = false; // Flag to show selection screen
+        this.stats = { ...raceData.stats }; // Specific stats like damage, range, lifesteal etc.
+        this.sent = snapshotPlayerNumbers(this); // Numeric state as of the last delta, see collectDirtyPlayers()
+
+        playerAtRow[row] = this;
+    }
+
+    // Position, velocity and radius are views onto the movement columns
+    get x() { return playerPosX[this.row]; }
+    set x(value) { playerPosX[this.row] = value; }
+    get y() { return playerPosY[this.row]; }
+    set y(value) { playerPosY[this.row] = value; }
+    get speed() { return playerSpeed[this.row]; }
+    set speed(value) { playerSpeed[this.row] = value; }
+    get radius() { return playerRadius[this.row]; }
+
+    // Velocity is direction * speed, applied by moveAndClamp() in the movement phase
+    setMoveDirection(dirX, dirY) {
+        playerDirX[this.row] = dirX;
+        playerDirY[this.row] = dirY;
+    }
+
+    stop() {
+        this.setMoveDirection(0, 0);
+    }
+
+    // Overwrites the input state in place; it arrives ~30 times a second per player
+    setInput(up, down, left, right, attack, mouseX, mouseY) {
+        let input = this.lastInput;
+        if (!input) {
+            input = this.lastInput = { up: false, down: false, left: false, right: false, attack: false, mouseX: 0, mouseY: 0 };
+        }
+        input.up = up;
+        input.down = down;
+        input.left = left;
+        input.right = right;
+        input.attack = attack;
+        input.mouseX = mouseX;
+        input.mouseY = mouseY;
+    }
+
+    clearInput() {
+        this.setInput(false, false, false, false, false, 0, 0);
+    }
+}
+
+function allocatePlayerRow() {
+    if (playerRowCount === playerCapacity) {
+        playerCapacity *= 2;
+        playerPosX = growColumn(playerPosX, playerCapacity);
+        playerPosY = growColumn(playerPosY, playerCapacity);
+        playerDirX = growColumn(playerDirX, playerCapacity);
+        playerDirY = growColumn(playerDirY, playerCapacity);
+        playerSpeed = growColumn(playerSpeed, playerCapacity);
+        playerRadius = growColumn(playerRadius, playerCapacity);
+        playerTreeX = growColumn(playerTreeX, playerCapacity);
+        playerTreeY = growColumn(playerTreeY, playerCapacity);
+    }
+    playerTreeMembershipChanged = true;
+    return playerRowCount++;
+}
+
+function growColumn(column, capacity) {
+    const grown = new Float64Array(capacity);
+    grown.set(column);
+    return grown;
+}
+
+// Removes a player and frees its movement row (safe to call more than once)
+function removePlayer(playerId) {
+    const player = players.get(playerId);
+    if (!player) return false;
+    players.delete(playerId);
+
+    const row = player.row;
+    const last = --playerRowCount;
+    if (row !== last) {
+        const moved = playerAtRow[last];
+        playerPosX[row] = playerPosX[last];
+        playerPosY[row] = playerPosY[last];
+        playerDirX[row] = playerDirX[last];
+        playerDirY[row] = playerDirY[last];
+        playerSpeed[row] = playerSpeed[last];
+        playerRadius[row] = playerRadius[last];
+        playerTreeX[row] = playerTreeX[last];
+        playerTreeY[row] = playerTreeY[last];
+        playerAtRow[row] = moved;
+        moved.row = row;
+    }
+    playerAtRow.length = last;
+    playerTreeMembershipChanged = true;
+
+    broadcast(JSON.stringify({ type: 'playerLeft', netId: player.netId }));
+    return true;
 }
 
 function getRaceBaseStats(race) {
@@ -95,14 +273,14 @@ function applyLevel2Specialization(player, choice) {
             player.maxHp *= 1.3;
             player.stats.damage *= 1.5; // Higher melee damage
             player.stats.range = MELEE_RANGE * 1.2; // Melee attack type, slight reach
-            player.color = lightenDarkenColor(player.color, -20); // Darker shade
+            player.color = shadedColor(player.color, -20); // Darker shade
             break;
         case 'mage':
             player.maxHp *= 0.9;
             player.stats.damage *= 12; // Standard projectile damage (increased slightly)
             player.stats.range = 400; // Ranged attack type
             player.stats.attackSpeedModifier = 0.8; // Slightly faster attacks
-            player.color = lightenDarkenColor(player.color, 20); // Lighter shade
+            player.color = shadedColor(player.color, 20); // Lighter shade
             break;
 
         // --- Vampire Mutations ---
@@ -141,25 +319,192 @@ function applyLevel2Specialization(player, choice) {
      player.hp = player.maxHp * hpPercent;
      if (player.hp > player.maxHp) player.hp = player.maxHp; // Cap HP
 
-     // Notify client about the update
-     safeSend(player.ws, JSON.stringify({ type: 'classSelected', player: getPlayerDataForClient(player) }));
+     // Notify client about the update, and everyone else about the new look
+     const playerData = getPlayerDataForClient(player);
+     safeSend(player.ws, JSON.stringify({ type: 'classSelected', player: playerData }));
+     broadcast(JSON.stringify({ type: 'playerInfo', player: playerData }), player.ws);
 }
 
 // --- Orb Logic ---
+class Orb {
+    constructor(slot) {
+        this.id = 0; // Reassigned on every spawn
+        this.slot = slot; // Index into the orb position columns
+        this.radius = ORB_RADIUS;
+        this.value = XP_PER_ORB;
+        this.color = '#f0e370'; // Yellowish
+        this.cellX = 0; // Grid cell, see gridInsertOrb()
+        this.cellY = 0;
+    }
+
+    get x() { return orbPosX[this.slot]; }
+    set x(value) { orbPosX[this.slot] = value; }
+    get y() { return orbPosY[this.slot]; }
+    set y(value) { orbPosY[this.slot] = value; }
+}
+
+// Collected orbs free their slot, and the slot's Orb object is re-initialised on the
+// next spawn, so the steady collect/respawn churn doesn't allocate.
 function spawnOrb() {
-    if (orbs.size < ORB_COUNT) {
-        const orbId = uuidv4();
-        orbs.set(orbId, {
-            id: orbId,
-            x: Math.random() * MAP_WIDTH,
-            y: Math.random() * MAP_HEIGHT,
-            radius: ORB_RADIUS,
-            value: XP_PER_ORB,
-            color: '#f0e370' // Yellowish
-        });
+    if (freeOrbSlots.length > 0) {
+        const slot = freeOrbSlots.pop();
+        const orb = orbAtSlot[slot] || (orbAtSlot[slot] = new Orb(slot));
+        orb.id = nextNetId++;
+        orb.x = Math.random() * MAP_WIDTH;
+        orb.y = Math.random() * MAP_HEIGHT;
+        orbs.set(orb.id, orb);
+        gridInsertOrb(orb);
+        orbsAdded.push(orb.id);
+    }
+}
+
+function collectOrb(orb) {
+    gridRemoveOrb(orb);
+    orbs.delete(orb.id);
+    orbsRemoved.push(orb.id);
+    freeOrbSlots.push(orb.slot);
+}
+
+// --- Orb Spatial Grid ---
+function orbCellKey(cx, cy) {
+    return cx * 65536 + cy; // Cell coords are small non-negative ints, so this packs them into one number key
+}
+
+function gridInsertOrb(orb) {
+    orb.cellX = Math.floor(orb.x / ORB_GRID_CELL);
+    orb.cellY = Math.floor(orb.y / ORB_GRID_CELL);
+    const key = orbCellKey(orb.cellX, orb.cellY);
+    let bucket = orbGrid.get(key);
+    if (!bucket) {
+        bucket = new Set();
+        orbGrid.set(key, bucket);
+    }
+    bucket.add(orb.slot);
+}
+
+function gridRemoveOrb(orb) {
+    const key = orbCellKey(orb.cellX, orb.cellY);
+    const bucket = orbGrid.get(key);
+    if (bucket) {
+        bucket.delete(orb.slot);
+        if (bucket.size === 0) orbGrid.delete(key);
+    }
+}
+
+// Orbs drift toward nearby players, so re-bucket them when they cross a cell boundary
+function gridMoveOrb(orb) {
+    const cx = Math.floor(orb.x / ORB_GRID_CELL);
+    const cy = Math.floor(orb.y / ORB_GRID_CELL);
+    if (cx !== orb.cellX || cy !== orb.cellY) {
+        gridRemoveOrb(orb);
+        gridInsertOrb(orb);
     }
 }
 
+// --- Player Quadtree ---
+// Point-region quadtree over players. Nodes split into four quadrants once they hold more than
+// QUADTREE_CAPACITY players; queryCircle() only descends into quadrants overlapping the circle.
+class Quadtree {
+    constructor(x, y, w, h, depth = 0) {
+        this.x = x;
+        this.y = y;
+        this.w = w;
+        this.h = h;
+        this.depth = depth;
+        this.items = []; // Each item is { x, y, player }
+        this.children = null;
+    }
+
+    insert(player, x = player.x, y = player.y) {
+        if (this.children) {
+            this.childFor(x, y).insert(player, x, y);
+            return;
+        }
+        this.items.push({ x: x, y: y, player: player });
+        if (this.items.length > QUADTREE_CAPACITY && this.depth < QUADTREE_MAX_DEPTH) {
+            this.split();
+        }
+    }
+
+    split() {
+        const hw = this.w / 2;
+        const hh = this.h / 2;
+        const d = this.depth + 1;
+        this.children = [
+            new Quadtree(this.x, this.y, hw, hh, d),
+            new Quadtree(this.x + hw, this.y, hw, hh, d),
+            new Quadtree(this.x, this.y + hh, hw, hh, d),
+            new Quadtree(this.x + hw, this.y + hh, hw, hh, d)
+        ];
+        const items = this.items;
+        this.items = [];
+        items.forEach(item => this.childFor(item.x, item.y).insert(item.player, item.x, item.y));
+    }
+
+    childFor(x, y) {
+        const right = x >= this.x + this.w / 2 ? 1 : 0;
+        const bottom = y >= this.y + this.h / 2 ? 2 : 0;
+        return this.children[right + bottom];
+    }
+
+    // Collects players whose indexed position lies within r of (cx, cy) into out
+    queryCircle(cx, cy, r, out = []) {
+        // Closest point of this node's rectangle to the circle center
+        const nx = Math.max(this.x, Math.min(cx, this.x + this.w));
+        const ny = Math.max(this.y, Math.min(cy, this.y + this.h));
+        if ((nx - cx) * (nx - cx) + (ny - cy) * (ny - cy) > r * r) return out;
+
+        if (this.children) {
+            this.children.forEach(child => child.queryCircle(cx, cy, r, out));
+        } else {
+            this.items.forEach(item => {
+                const dx = item.x - cx;
+                const dy = item.y - cy;
+                if (dx * dx + dy * dy <= r * r) out.push(item.player);
+            });
+        }
+        return out;
+    }
+}
+
+// Called by the game loop once before each phase that queries players (not per query).
+// Small games skip the tree entirely. Otherwise the tree is rebuilt only when players joined
+// or left, or someone drifted more than QUADTREE_SLACK from where it was indexed; queries are
+// padded by that slack. Players removed after a refresh stay in the tree until the next one,
+// so callers must check candidates are still in `players`.
+function refreshPlayerTree() {
+    if (playerRowCount < QUADTREE_MIN_PLAYERS) {
+        playerTree = null;
+        return;
+    }
+
+    let stale = playerTree === null || playerTreeMembershipChanged;
+    for (let row = 0; !stale && row < playerRowCount; row++) {
+        stale = Math.abs(playerPosX[row] - playerTreeX[row]) > QUADTREE_SLACK ||
+                Math.abs(playerPosY[row] - playerTreeY[row]) > QUADTREE_SLACK;
+    }
+    if (!stale) return;
+
+    playerTree = new Quadtree(0, 0, MAP_WIDTH, MAP_HEIGHT);
+    for (let row = 0; row < playerRowCount; row++) {
+        playerTreeX[row] = playerPosX[row];
+        playerTreeY[row] = playerPosY[row];
+        playerTree.insert(playerAtRow[row]);
+    }
+    playerTreeMembershipChanged = false;
+}
+
+// Players that may be within r of (x, y); callers still do the exact distance check.
+// Returns the shared nearbyPlayers array, so consume it before querying again.
+function queryPlayersNear(x, y, r) {
+    nearbyPlayers.length = 0;
+    if (playerTree === null) {
+        return collectInCircle(playerPosX, playerPosY, playerAtRow, playerRowCount, x, y, r, nearbyPlayers);
+    }
+    // Diagonal drift can reach sqrt(2) * QUADTREE_SLACK
+    return playerTree.queryCircle(x, y, r + QUADTREE_SLACK * Math.SQRT2, nearbyPlayers);
+}
+
 // --- Projectile Logic ---
 function createProjectile(owner) {
     // Check range indicates a ranged attack type (e.g., Mage)
@@ -167,11 +512,12 @@ function createProjectile(owner) {
         return; // Only ranged classes shoot projectiles (use a slightly larger threshold than MELEE_RANGE)
     }
 
-    const projId = uuidv4();
+    const projId = nextNetId++;
     const angle = Math.atan2(owner.lastInput.mouseY - owner.y, owner.lastInput.mouseX - owner.x);
     const speed = owner.stats.projectileSpeed || PROJECTILE_SPEED;
     const range = owner.stats.range; // Use player's stats for range
 
+    const color = shadedColor(owner.color, 30); // Slightly lighter than owner
     projectiles.set(projId, {
         id: projId,
         ownerId: owner.id,
@@ -179,9 +525,11 @@ function createProjectile(owner) {
         y: owner.y + Math.sin(angle) * (owner.radius + PROJECTILE_RADIUS + 1),
         dx: Math.cos(angle) * speed,
         dy: Math.sin(angle) * speed,
+        speed: speed, // Distance covered per tick, so range can be spent without a sqrt
         radius: PROJECTILE_RADIUS,
         damage: owner.stats.damage || PROJECTILE_DAMAGE,
-        color: lightenDarkenColor(owner.color, 30), // Slightly lighter than owner
+        color: color,
+        rgb: colorToRgb(color), // Packed form of color for binary frames
         rangeLeft: range // Use player's range stat
     });
 
@@ -211,13 +559,20 @@ function performMeleeAttack(attacker) {
     }));
 
 
-    for (const [targetId, target] of players) {
+    const attackerX = attacker.x;
+    const attackerY = attacker.y;
+    const candidates = queryPlayersNear(attackerX, attackerY, reach + PLAYER_RADIUS);
+    for (const target of candidates) {
+        const targetId = target.id;
         if (targetId === attacker.id || target.isDead || target.canChooseLevel2) continue; // Don't hit self, dead, or choosing players
+        if (players.get(targetId) !== target) continue; // Left since the tree was built
 
-        const dist = distance(attacker.x, attacker.y, target.x, target.y);
+        const offX = target.x - attackerX;
+        const offY = target.y - attackerY;
+        const hitRange = reach + target.radius;
         // Check if target is within range AND the cone
-        if (dist < reach + target.radius) {
-            const targetAngle = Math.atan2(target.y - attacker.y, target.x - attacker.x);
+        if (offX * offX + offY * offY < hitRange * hitRange) {
+            const targetAngle = Math.atan2(offY, offX);
             const angleDiff = Math.abs(normalizeAngle(attackAngle - targetAngle));
 
              // Check if target is within the attack cone
@@ -250,21 +605,17 @@ function dealDamage(target, damage, dealer) {
          // Client will see HP change in the next state update
     }
 
-    // Notify the target client they were hit (for visual effect)
-     safeSend(target.ws, JSON.stringify({
-         type: 'wasHit',
-         damageTaken: actualDamage
-     }));
+    // Notify the target client they were hit (for visual effect); coalesced per tick
+    pendingHits.set(target, (pendingHits.get(target) || 0) + actualDamage);
 
 
     if (target.hp <= 0) {
         target.hp = 0;
         target.isDead = true;
-        target.vx = 0;
-        target.vy = 0;
+        target.stop();
         // Clear existing input to stop movement prediction on client
-        target.lastInput = { up: false, down: false, left: false, right: false, attack: false, mouseX: 0, mouseY: 0 };
-        console.log(`${target.name} killed by ${dealer ? dealer.name : 'Unknown'}`);
+        target.clearInput();
+        if (DEBUG_LOGGING) console.log(`${target.name} killed by ${dealer ? dealer.name : 'Unknown'}`);
 
         if (dealer && players.has(dealer.id)) { // Check if dealer still exists
              dealer.killCount++;
@@ -305,12 +656,24 @@ function dealDamage(target, damage, dealer) {
                  target.isDead = false;
                  // Reset kill count on death? Or keep it for leaderboard score? Let's keep for simplicity.
                  // target.killCount = 0;
-                 console.log(`${target.name} respawned`);
+                 if (DEBUG_LOGGING) console.log(`${target.name} respawned`);
             }
         }, 5000); // 5 second respawn timer
     }
 }
 
+// Sends each player hit this tick a single 'wasHit' with the total damage taken,
+// instead of one message per melee swing or projectile
+function flushHits() {
+    pendingHits.forEach((damageTaken, target) => {
+        safeSend(target.ws, JSON.stringify({
+            type: 'wasHit',
+            damageTaken: damageTaken
+        }));
+    });
+    pendingHits.clear();
+}
+
 // Helper to get stats AFTER level 2 selection (used for respawn HP)
 function getPlayerStatsAfterLevel2(race, choice) {
      const base = getRaceBaseStats(race); // Start from base race stats
@@ -337,14 +700,28 @@ function checkLevelUp(player) {
         player.canChooseLevel2 = true; // Set flag
         // Notify the client they can level up
         safeSend(player.ws, JSON.stringify({ type: 'levelUpReady' }));
-        console.log(`${player.name} reached Level 2! Awaiting class selection.`);
+        if (DEBUG_LOGGING) console.log(`${player.name} reached Level 2! Awaiting class selection.`);
     }
     // Add logic for higher levels later if needed
 }
 
 // --- Utility Functions ---
-function distance(x1, y1, x2, y2) {
-    return Math.sqrt(Math.pow(x1 - x2, 2) + Math.pow(y1 - y2, 2));
+// Unit movement vectors for every (moveX, moveY) in {-1, 0, 1}^2, so input normalization
+// is a table lookup instead of a hypot and two divisions per player per tick
+const MOVE_DIR_X = new Float64Array(9);
+const MOVE_DIR_Y = new Float64Array(9);
+for (let moveX = -1; moveX <= 1; moveX++) {
+    for (let moveY = -1; moveY <= 1; moveY++) {
+        const magnitude = Math.hypot(moveX, moveY);
+        if (magnitude > 0) {
+            MOVE_DIR_X[moveDirIndex(moveX, moveY)] = moveX / magnitude;
+            MOVE_DIR_Y[moveDirIndex(moveX, moveY)] = moveY / magnitude;
+        }
+    }
+}
+
+function moveDirIndex(moveX, moveY) {
+    return (moveX + 1) * 3 + (moveY + 1);
 }
 
 function normalizeAngle(angle) {
@@ -378,6 +755,26 @@ function lightenDarkenColor(col, amt) {
     return (usePound ? "#" : "") + color;
 }
 
+// Memoized lightenDarkenColor(); player colors come from a small fixed set, so every
+// projectile would otherwise re-parse and re-format the same handful of strings
+function shadedColor(col, amt) {
+    const key = col + '|' + amt;
+    let shaded = shadedColorCache.get(key);
+    if (shaded === undefined) {
+        shaded = lightenDarkenColor(col, amt);
+        shadedColorCache.set(key, shaded);
+    }
+    return shaded;
+}
+
+function colorToRgb(col) {
+    let rgb = colorRgbCache.get(col);
+    if (rgb === undefined) {
+        rgb = parseInt(col.slice(1), 16);
+        colorRgbCache.set(col, rgb);
+    }
+    return rgb;
+}
 
 // Safe send function to avoid errors if ws is closed
 function safeSend(ws, data) {
@@ -391,17 +788,29 @@ function safeSend(ws, data) {
 }
 
 // --- Game Loop ---
-function gameLoop() {
+// Lets queued socket events (input, joins, disconnects) run in the middle of a long phase
+function yieldToEventLoop() {
+    return new Promise(resolve => setImmediate(resolve));
+}
+
+// The per-entity phases yield every TICK_YIELD_MASK + 1 iterations, so with many players or
+// projectiles a tick can't hold the event loop for its whole duration. Small games never yield.
+// Everything that runs during a yield only touches state the loops tolerate: inputs, Map
+// inserts/deletes (which for...of handles) and player rows (refreshed on every query).
+async function gameLoop() {
     const now = Date.now();
     const deltaTime = (now - (lastUpdateTime || now)) / 1000.0; // Time since last update in seconds
     lastUpdateTime = now;
+    let iteration = 0;
 
-    // 1. Process Inputs & Update Velocities
-    players.forEach(player => {
+    // 1. Process Inputs & Update Movement Directions
+    refreshPlayerTree(); // Melee attacks below query it
+    for (const player of players.values()) {
+        if ((++iteration & TICK_YIELD_MASK) === 0) await yieldToEventLoop();
+        if (players.get(player.id) !== player) continue; // Disconnected during the yield
         if (player.isDead || player.canChooseLevel2 || !player.lastInput) {
-             player.vx = 0;
-             player.vy = 0;
-             return;
+             player.stop();
+             continue;
         }
 
         let moveX = 0;
@@ -412,14 +821,9 @@ function gameLoop() {
         if (player.lastInput.left) moveX -= 1;
         if (player.lastInput.right) moveX += 1;
 
-        const magnitude = Math.sqrt(moveX * moveX + moveY * moveY);
-        if (magnitude > 0) {
-            player.vx = (moveX / magnitude) * player.speed;
-            player.vy = (moveY / magnitude) * player.speed;
-        } else {
-            player.vx = 0;
-            player.vy = 0;
-        }
+        // Speed is applied in the movement kernel, so this is just a table lookup
+        const dir = moveDirIndex(moveX, moveY);
+        player.setMoveDirection(MOVE_DIR_X[dir], MOVE_DIR_Y[dir]);
 
         // Attack Cooldown
         if (player.attackCooldown > 0) {
@@ -442,111 +846,289 @@ function gameLoop() {
              }
              // Note: inputState.attack is reset client-side per tick. Server just acts if it sees true.
         }
-    });
 
-    // 2. Update Positions & Check Boundaries
-    players.forEach(player => {
-        if (player.isDead || player.canChooseLevel2) return;
-        player.x += player.vx; // Simple Euler integration
-        player.y += player.vy;
+        // An attack can level the player up, which pauses it for class selection
+        if (player.canChooseLevel2) {
+            player.stop();
+        }
+    }
 
-        // Boundary checks
-        player.x = Math.max(player.radius, Math.min(MAP_WIDTH - player.radius, player.x));
-        player.y = Math.max(player.radius, Math.min(MAP_HEIGHT - player.radius, player.y));
-    });
+    // 2. Update Positions & Check Boundaries
+    // Dead or choosing players were stopped above, so every row can be integrated
+    moveAndClamp(playerPosX, playerPosY, playerDirX, playerDirY, playerSpeed, playerRadius, playerRowCount, MAP_WIDTH, MAP_HEIGHT);
+    refreshPlayerTree(); // Positions changed; projectile hits below query it
 
      // 3. Update Projectiles & Check Collisions
-    const projectilesToRemove = [];
-    projectiles.forEach(proj => {
+    projectilesToRemove.length = 0;
+    iteration = 0;
+    for (const proj of projectiles.values()) {
+        if ((++iteration & TICK_YIELD_MASK) === 0) await yieldToEventLoop();
+        if (projectiles.get(proj.id) !== proj) continue; // Removed during the yield
         proj.x += proj.dx;
         proj.y += proj.dy;
-        const distanceTraveled = Math.sqrt(proj.dx*proj.dx + proj.dy*proj.dy);
-        proj.rangeLeft -= distanceTraveled;
+        proj.rangeLeft -= proj.speed;
 
         // Check projectile out of range or bounds
         if (proj.rangeLeft <= 0 || proj.x < -100 || proj.x > MAP_WIDTH + 100 || proj.y < -100 || proj.y > MAP_HEIGHT + 100) { // Add margin
             projectilesToRemove.push(proj.id);
-            return; // Continue to next projectile
+            continue; // Continue to next projectile
         }
 
-        // Check projectile collision with players
-        for (const [targetId, target] of players) {
+        // Check projectile collision with nearby players
+        const candidates = queryPlayersNear(proj.x, proj.y, proj.radius + PLAYER_RADIUS);
+        for (const target of candidates) {
+            const targetId = target.id;
             if (targetId === proj.ownerId || target.isDead || target.canChooseLevel2) continue; // Don't hit self, dead, or choosing players
+            if (players.get(targetId) !== target) continue; // Left since the tree was built
 
-            const dist = distance(proj.x, proj.y, target.x, target.y);
-            if (dist < target.radius + proj.radius) {
+            const offX = target.x - proj.x;
+            const offY = target.y - proj.y;
+            const hitRange = target.radius + proj.radius;
+            if (offX * offX + offY * offY < hitRange * hitRange) {
                 const owner = players.get(proj.ownerId);
                 dealDamage(target, proj.damage, owner);
                 projectilesToRemove.push(proj.id); // Remove projectile on hit
-                 return; // Projectile hits one target, stop checking players for this projectile
+                 break; // Projectile hits one target, stop checking players for this projectile
             }
         }
-    });
+    }
     projectilesToRemove.forEach(id => projectiles.delete(id));
+    flushHits(); // Melee (step 1) and projectile (step 3) hits are all in by now
+
+
+    // 4. Check Player-Orb Collisions (only orbs in the 3x3 grid cells around each player)
+    iteration = 0;
+    for (const player of players.values()) {
+        if ((++iteration & TICK_YIELD_MASK) === 0) await yieldToEventLoop();
+        if (players.get(player.id) !== player) continue; // Disconnected during the yield
+        if (player.isDead || player.canChooseLevel2) continue; // Don't collect orbs while choosing class or dead
+
+        const playerX = player.x;
+        const playerY = player.y;
+        const playerR = player.radius;
+        const attractRadius = playerR + ORB_RADIUS + ORB_ATTRACT_RANGE; // Orbs get attracted slightly
+        const attractRadiusSq = attractRadius * attractRadius;
+        const collectRadius = playerR + ORB_RADIUS;
+        const collectRadiusSq = collectRadius * collectRadius;
+        const cx = Math.floor(playerX / ORB_GRID_CELL);
+        const cy = Math.floor(playerY / ORB_GRID_CELL);
+        nearbyOrbs.length = 0;
+        for (let dx = -1; dx <= 1; dx++) {
+            for (let dy = -1; dy <= 1; dy++) {
+                const bucket = orbGrid.get(orbCellKey(cx + dx, cy + dy));
+                if (bucket) bucket.forEach(slot => nearbyOrbs.push(slot));
+            }
+        }
 
-
-    // 4. Check Player-Orb Collisions
-    const orbsToRemove = [];
-    players.forEach(player => {
-        if (player.isDead || player.canChooseLevel2) return; // Don't collect orbs while choosing class or dead
-
-        orbs.forEach(orb => {
-            const dist = distance(player.x, player.y, orb.x, orb.y);
-            const attractRadius = player.radius + orb.radius + 50; // Orbs get attracted slightly
-            if (dist < attractRadius) {
-                 // Simple attraction logic
-                 const angle = Math.atan2(player.y - orb.y, player.x - orb.x);
+        // Distance tests read the position columns; the Orb object is only touched when in range
+        for (let i = 0; i < nearbyOrbs.length; i++) {
+            const slot = nearbyOrbs[i];
+            const offX = playerX - orbPosX[slot];
+            const offY = playerY - orbPosY[slot];
+            const distSq = offX * offX + offY * offY;
+            if (distSq >= attractRadiusSq) continue;
+
+            const orb = orbAtSlot[slot];
+            if (distSq > 0) {
+                 // Simple attraction logic: step along the unit vector toward the player
                  const attractSpeed = 1; // Pixels per tick
-                 orb.x += Math.cos(angle) * attractSpeed;
-                 orb.y += Math.sin(angle) * attractSpeed;
+                 const step = attractSpeed / Math.sqrt(distSq);
+                 orbPosX[slot] += offX * step;
+                 orbPosY[slot] += offY * step;
+                 gridMoveOrb(orb);
+                 orbsMoved.add(orb.id);
             }
 
-
-            if (dist < player.radius + orb.radius) { // Actual collision
+            if (distSq < collectRadiusSq) { // Actual collision
                 player.xp += orb.value;
-                orbsToRemove.push(orb.id);
+                collectOrb(orb); // Removed right away so a second player can't collect it this tick
                 checkLevelUp(player); // Check if player leveled up
             }
-        });
-    });
-    orbsToRemove.forEach(id => orbs.delete(id));
+        }
+    }
 
     // 5. Spawn new orbs
-    if (Math.random() < 0.2 && orbs.size < ORB_COUNT) { // Chance to spawn an orb each tick, up to max
+    if (Math.random() < 0.2 && freeOrbSlots.length > 0) { // Chance to spawn an orb each tick, up to max
         spawnOrb();
     }
 
-    // 6. Prepare State Update for Clients
-    const playersData = [];
-    players.forEach(p => {
-        // Send player data including dead state and canChooseLevel2
-        playersData.push(getPlayerDataForClient(p));
-    });
-    const orbsData = Array.from(orbs.values());
-    const projectilesData = Array.from(projectiles.values());
-
-    const gameState = {
-        type: 'gameState',
-        players: playersData,
-        orbs: orbsData,
-        projectiles: projectilesData
+    // 6. Prepare State Delta for Clients
+    const stateDelta = encodeStateDelta();
+
+    // 7. Broadcast State to all connected clients, skipping ticks where nothing changed
+    ticksSinceDelta++;
+    if (stateDelta !== null || ticksSinceDelta >= KEEPALIVE_TICKS) {
+        broadcast(stateDelta || EMPTY_DELTA);
+        ticksSinceDelta = 0;
+    }
+}
+
+// --- State Deltas ---
+function snapshotPlayerNumbers(player) {
+    return {
+        x: player.x,
+        y: player.y,
+        hp: player.hp,
+        maxHp: player.maxHp,
+        xp: player.xp,
+        killCount: player.killCount,
+        level: player.level,
+        flags: (player.isDead ? PLAYER_FLAG_DEAD : 0) | (player.canChooseLevel2 ? PLAYER_FLAG_CHOOSING : 0)
     };
-    const gameStateString = JSON.stringify(gameState);
-
-    // 7. Broadcast State to all connected clients
-    wss.clients.forEach(client => {
-        if (client.readyState === WebSocket.OPEN) {
-            // Optional: send only nearby players/orbs/projectiles
-            // For simplicity, broadcasting full state in this minimal example
-            safeSend(client, gameStateString);
+}
+
+// Fills `out` with players whose numeric state differs from what was last sent,
+// updating their sent snapshot in place
+function collectDirtyPlayers(out) {
+    out.length = 0;
+    players.forEach(player => {
+        const sent = player.sent;
+        const flags = (player.isDead ? PLAYER_FLAG_DEAD : 0) | (player.canChooseLevel2 ? PLAYER_FLAG_CHOOSING : 0);
+        if (Math.abs(sent.x - player.x) > POSITION_EPSILON || Math.abs(sent.y - player.y) > POSITION_EPSILON || sent.hp !== player.hp || sent.maxHp !== player.maxHp ||
+            sent.xp !== player.xp || sent.killCount !== player.killCount || sent.level !== player.level || sent.flags !== flags) {
+            sent.x = player.x;
+            sent.y = player.y;
+            sent.hp = player.hp;
+            sent.maxHp = player.maxHp;
+            sent.xp = player.xp;
+            sent.killCount = player.killCount;
+            sent.level = player.level;
+            sent.flags = flags;
+            out.push(player);
         }
     });
+    return out;
+}
+
+// Packs changed players, orb adds/moves/removes and all live projectiles (they move every tick)
+// into one little-endian frame, then resets the orb change lists. Returns null if nothing changed,
+// counting the last projectiles vanishing as a change so clients drop them.
+// Layout: u8 MSG_STATE_DELTA, then for each section a u16 count followed by fixed-size records.
+function encodeStateDelta() {
+    collectDirtyPlayers(dirtyPlayers);
+    const added = addedOrbs;
+    const moved = movedOrbs;
+    added.length = 0;
+    moved.length = 0;
+    orbsAdded.forEach(id => {
+        const orb = orbs.get(id);
+        if (orb) added.push(orb);
+    });
+    orbsMoved.forEach(id => {
+        const orb = orbs.get(id);
+        if (orb && !orbsAdded.includes(id)) moved.push(orb);
+    });
+
+    if (dirtyPlayers.length === 0 && added.length === 0 && moved.length === 0 &&
+        orbsRemoved.length === 0 && projectiles.size === 0 && lastSentProjectileCount === 0) {
+        orbsAdded.length = 0;
+        orbsMoved.clear();
+        return null;
+    }
+
+    const size = 1 +
+        2 + dirtyPlayers.length * PLAYER_DELTA_BYTES +
+        2 + added.length * ORB_DELTA_BYTES +
+        2 + moved.length * ORB_DELTA_BYTES +
+        2 + orbsRemoved.length * ORB_REMOVE_BYTES +
+        2 + projectiles.size * PROJECTILE_DELTA_BYTES;
+    const buf = Buffer.allocUnsafe(size);
+    let o = buf.writeUInt8(MSG_STATE_DELTA, 0);
+
+    o = buf.writeUInt16LE(dirtyPlayers.length, o);
+    dirtyPlayers.forEach(p => {
+        o = buf.writeUInt32LE(p.netId, o);
+        o = buf.writeFloatLE(p.x, o);
+        o = buf.writeFloatLE(p.y, o);
+        o = buf.writeFloatLE(p.hp, o);
+        o = buf.writeFloatLE(p.maxHp, o);
+        o = buf.writeFloatLE(p.xp, o);
+        o = buf.writeUInt32LE(p.killCount, o);
+        o = buf.writeUInt8(p.level, o);
+        o = buf.writeUInt8(p.sent.flags, o);
+    });
+
+    [added, moved].forEach(list => {
+        o = buf.writeUInt16LE(list.length, o);
+        list.forEach(orb => {
+            o = buf.writeUInt32LE(orb.id, o);
+            o = buf.writeFloatLE(orb.x, o);
+            o = buf.writeFloatLE(orb.y, o);
+        });
+    });
+
+    o = buf.writeUInt16LE(orbsRemoved.length, o);
+    orbsRemoved.forEach(orbId => {
+        o = buf.writeUInt32LE(orbId, o);
+    });
+
+    o = buf.writeUInt16LE(projectiles.size, o);
+    projectiles.forEach(proj => {
+        o = buf.writeUInt32LE(proj.id, o);
+        o = buf.writeFloatLE(proj.x, o);
+        o = buf.writeFloatLE(proj.y, o);
+        o = buf.writeFloatLE(proj.dx, o);
+        o = buf.writeFloatLE(proj.dy, o);
+        o = buf.writeUInt32LE(proj.rgb, o);
+    });
+
+    orbsAdded.length = 0;
+    orbsMoved.clear();
+    orbsRemoved.length = 0;
+    lastSentProjectileCount = projectiles.size;
+    return buf;
+}
+
+// Queues the same payload (string or Buffer) for every open client except `except`.
+// Sends go out BROADCAST_BATCH_SIZE at a time with a setImmediate() yield in between, so a
+// large fan-out doesn't hold up incoming input. The queue is FIFO, so each client still
+// receives messages in the order they were broadcast.
+function broadcast(data, except = null) {
+    queueSend(getClientList(), data, except);
+}
+
+// Snapshot of wss.clients, rebuilt only after a connect/disconnect. Never mutated once handed
+// out, so queued broadcast jobs can keep holding it.
+function getClientList() {
+    if (clientList === null) clientList = Array.from(wss.clients);
+    return clientList;
+}
+
+// Queues a payload for specific clients behind any broadcasts still draining
+function queueSend(clients, data, except = null) {
+    broadcastQueue.push({ data: data, clients: clients, except: except, next: 0 });
+    if (!broadcastDraining) {
+        broadcastDraining = true;
+        drainBroadcastQueue();
+    }
+}
+
+function drainBroadcastQueue() {
+    let budget = BROADCAST_BATCH_SIZE;
+    while (broadcastQueue.length > 0 && budget > 0) {
+        const job = broadcastQueue[0];
+        while (job.next < job.clients.length && budget > 0) {
+            const client = job.clients[job.next++];
+            if (client !== job.except && client.readyState === WebSocket.OPEN) {
+                safeSend(client, job.data);
+                budget--;
+            }
+        }
+        if (job.next === job.clients.length) broadcastQueue.shift();
+    }
+
+    if (broadcastQueue.length > 0) {
+        setImmediate(drainBroadcastQueue);
+    } else {
+        broadcastDraining = false;
+    }
 }
 
 // Function to get player data suitable for sending to clients (omit ws object)
 function getPlayerDataForClient(player) {
     return {
         id: player.id,
+        netId: player.netId,
         name: player.name,
         x: player.x,
         y: player.y,
@@ -565,10 +1147,20 @@ function getPlayerDataForClient(player) {
 }
 
 
+function getOrbDataForClient(orb) {
+    return { netId: orb.id, x: orb.x, y: orb.y, radius: orb.radius, color: orb.color };
+}
+
+function getProjectileDataForClient(proj) {
+    return { netId: proj.id, x: proj.x, y: proj.y, dx: proj.dx, dy: proj.dy, radius: proj.radius, color: proj.color };
+}
+
+
 // --- WebSocket Server Logic ---
 wss.on('connection', (ws) => {
+    clientList = null; // Broadcast recipients changed
     const playerId = uuidv4();
-    console.log(`Client connected: ${playerId}`);
+    if (DEBUG_LOGGING) console.log(`Client connected: ${playerId}`);
     let currentPlayer = null; // Will be set on 'join'
 
     ws.on('message', (message) => {
@@ -582,22 +1174,27 @@ wss.on('connection', (ws) => {
                     if (!players.has(playerId)) {
                          const name = data.name ? data.name.substring(0, 16) : 'Anon';
                          const race = data.race || 'human';
-                         currentPlayer = createPlayer(playerId, ws, name, race);
+                         currentPlayer = new Player(playerId, ws, name, race);
                          players.set(playerId, currentPlayer);
-                         console.log(`Player ${currentPlayer.name} (${currentPlayer.race}) joined with ID ${playerId}`);
+                         if (DEBUG_LOGGING) console.log(`Player ${currentPlayer.name} (${currentPlayer.race}) joined with ID ${playerId}`);
 
-                        // Send initial state to the new player
-                        safeSend(ws, JSON.stringify({
+                        // Send full snapshot to the new player; later ticks only carry deltas.
+                        // Queued so that deltas from before the snapshot can't arrive after it.
+                        queueSend([ws], JSON.stringify({
                             type: 'welcome',
                             playerId: playerId,
                             mapWidth: MAP_WIDTH,
                             mapHeight: MAP_HEIGHT,
+                            orbRadius: ORB_RADIUS,
+                            projectileRadius: PROJECTILE_RADIUS,
                             initialState: { // Send current game state
                                 players: Array.from(players.values()).map(getPlayerDataForClient),
-                                orbs: Array.from(orbs.values()),
-                                projectiles: Array.from(projectiles.values())
+                                orbs: Array.from(orbs.values()).map(getOrbDataForClient),
+                                projectiles: Array.from(projectiles.values()).map(getProjectileDataForClient)
                             }
                         }));
+                        // Everyone else learns about the newcomer once; its movement arrives in deltas
+                        broadcast(JSON.stringify({ type: 'playerJoined', player: getPlayerDataForClient(currentPlayer) }), ws);
                     }
                     break;
 
@@ -608,18 +1205,18 @@ wss.on('connection', (ws) => {
                          const mouseX = typeof data.input.mouseX === 'number' ? data.input.mouseX : 0;
                          const mouseY = typeof data.input.mouseY === 'number' ? data.input.mouseY : 0;
 
-                         currentPlayer.lastInput = {
-                             up: !!data.input.up, // Ensure boolean
-                             down: !!data.input.down,
-                             left: !!data.input.left,
-                             right: !!data.input.right,
-                             attack: !!data.input.attack,
-                             mouseX: mouseX,
-                             mouseY: mouseY
-                         };
+                         currentPlayer.setInput(
+                             !!data.input.up, // Ensure boolean
+                             !!data.input.down,
+                             !!data.input.left,
+                             !!data.input.right,
+                             !!data.input.attack,
+                             mouseX,
+                             mouseY
+                         );
                     } else if (currentPlayer) {
                          // Clear input if player is dead or choosing class
-                          currentPlayer.lastInput = { up: false, down: false, left: false, right: false, attack: false, mouseX: 0, mouseY: 0 };
+                          currentPlayer.clearInput();
                     }
                     break;
 
@@ -629,9 +1226,9 @@ wss.on('connection', (ws) => {
                          const validChoices = ['warrior', 'mage', 'lord', 'higher', 'king', 'hobgoblin'];
                          if (validChoices.includes(data.choice)) {
                              applyLevel2Specialization(currentPlayer, data.choice);
-                             console.log(`${currentPlayer.name} chose: ${data.choice}`);
+                             if (DEBUG_LOGGING) console.log(`${currentPlayer.name} chose: ${data.choice}`);
                          } else {
-                             console.warn(`Invalid class selection for ${currentPlayer.name}: ${data.choice}`);
+                             if (DEBUG_LOGGING) console.warn(`Invalid class selection for ${currentPlayer.name}: ${data.choice}`);
                              // Optional: send an error back to the client
                          }
                      }
@@ -645,10 +1242,10 @@ wss.on('connection', (ws) => {
     });
 
     ws.on('close', () => {
-        console.log(`Client disconnected: ${playerId}`);
-        if (currentPlayer) {
-            players.delete(playerId);
-            console.log(`Player ${currentPlayer.name} removed.`);
+        clientList = null; // Broadcast recipients changed
+        if (DEBUG_LOGGING) console.log(`Client disconnected: ${playerId}`);
+        if (currentPlayer && removePlayer(playerId)) {
+            if (DEBUG_LOGGING) console.log(`Player ${currentPlayer.name} removed.`);
         }
          // Maybe broadcast player disconnect to others?
     });
@@ -656,9 +1253,8 @@ wss.on('connection', (ws) => {
     ws.onerror = (error) => {
         console.error(`WebSocket error for ${playerId}: `, error);
          // Clean up player if connection breaks unexpectedly
-        if (currentPlayer) {
-            players.delete(playerId);
-            console.log(`Player ${currentPlayer.name} removed due to error.`);
+        if (currentPlayer && removePlayer(playerId)) {
+            if (DEBUG_LOGGING) console.log(`Player ${currentPlayer.name} removed due to error.`);
         }
     };
 });
@@ -673,7 +1269,12 @@ for (let i = 0; i < ORB_COUNT * 0.8; i++) { // Start with 80% of orbs
 }
 // Start the game loop
 let lastUpdateTime = Date.now();
-setInterval(gameLoop, 1000 / 60); // ~60 FPS game logic update rate
+let tickInProgress = false; // A tick that yielded may still be running when the next interval fires
+setInterval(() => {
+    if (tickInProgress) return;
+    tickInProgress = true;
+    gameLoop().finally(() => { tickInProgress = false; });
+}, 1000 / 60); // ~60 FPS game logic update rate
 
 // --- Start Server ---
 const PORT = process.env.PORT || 3000;
@@ -0,0 +1,35 @@
+// tick.js
+// Numeric kernels for the game loop. They only touch typed-array columns and plain
+// numbers (no player objects, no Maps), which keeps them monomorphic so V8 can compile
+// each one down to a tight machine-code loop.
+
+// Moves rows [0, n) one tick along their unit direction at their speed (simple Euler
+// integration) and clamps each position inside the map, keeping the entity's radius clear
+// of the edges. Velocity is formed here rather than stored, so the whole movement phase is
+// this one pass over the columns.
+function moveAndClamp(posX, posY, dirX, dirY, speed, radius, n, mapWidth, mapHeight) {
+    for (let row = 0; row < n; row++) {
+        const r = radius[row];
+        const s = speed[row];
+        const x = posX[row] + dirX[row] * s;
+        const y = posY[row] + dirY[row] * s;
+        const maxX = mapWidth - r;
+        const maxY = mapHeight - r;
+        posX[row] = x < r ? r : (x > maxX ? maxX : x);
+        posY[row] = y < r ? r : (y > maxY ? maxY : y);
+    }
+}
+
+// Pushes items[row] onto out for every row in [0, n) within r of (x, y).
+// Uses squared distances only.
+function collectInCircle(posX, posY, items, n, x, y, r, out) {
+    const rSq = r * r;
+    for (let row = 0; row < n; row++) {
+        const dx = posX[row] - x;
+        const dy = posY[row] - y;
+        if (dx * dx + dy * dy <= rSq) out.push(items[row]);
+    }
+    return out;
+}
+
+module.exports = { moveAndClamp, collectInCircle };